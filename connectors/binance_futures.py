@@ -15,6 +15,9 @@ import json
 import threading
 
 from models import *  # own data types
+from screener import Screener
+from timeseries import DerivativesStore
+from connectors.bootstrap import LazyRequest
 
 
 #%%
@@ -44,6 +47,8 @@ logger = logging.getLogger()
 
 class BinanceFuturesClient:
     def __init__(self, public_key: str, secret_key: str, testnet: bool):
+        self.platform = "binance"  # lets exchange-agnostic code (e.g. order_manager.py) know which connector it is talking to
+
         if testnet:
             self._base_url = "https://testnet.binancefuture.com"
             self._wss_url = "wss://stream.binancefuture.com/ws"
@@ -56,21 +61,76 @@ class BinanceFuturesClient:
 
         self._headers = {'X-MBX-APIKEY': self._public_key}
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        # no network calls in here anymore, see start() and the contracts/balances properties below
+        self._contracts = LazyRequest(self.get_contracts)
+        self._balances = LazyRequest(self.get_balances)
 
         self.prices = dict()
+        self.screener = Screener()  # rolling statistics of all contracts, fed by the websocket below
+        self.derivatives = DerivativesStore()  # mark/index price, funding rate (+ open interest) history per symbol
+        self.risk = None  # optional RiskEngine (risk.py), checks every order before it is sent
+        self.order_manager = None  # optional OrderManager (order_manager.py), sets itself here
 
         self._ws_id = 1
         self._ws = None
+        self._ws_thread = None
+        self._running = False
+        self._ws_lock = threading.Lock()  # shared by _start_ws() and close(), so close() can't slip in before run_forever()
+
+        logger.info("Binance Futures Client sucessfully initialized")
+
+    # contracts and balances are loaded lazily: the request is only sent by start() or on first access,
+    # and reading them waits for the answer if it hasn't arrived yet
+    @property
+    def contracts(self) -> dict[str, Contract]:
+        return self._contracts.get()
+
+    @contracts.setter
+    def contracts(self, value: dict[str, Contract]):
+        self._contracts.set(value)
+
+    @property
+    def balances(self) -> dict[str, Balance]:
+        return self._balances.get()
+
+    @balances.setter
+    def balances(self, value: dict[str, Balance]):
+        self._balances.set(value)
+
+    def pending_requests(self) -> list:
+        return [f for f in (self._contracts.pending(), self._balances.pending()) if f is not None]
+
+    def start(self):
+        # returns immediately: REST requests and websocket all run in the background
+        if self._running:
+            return
+        self._running = True
+
+        self._contracts.future()  # sends the request in the background, unless it is already running/done
+        self._balances.future()  # sends the request in the background, unless it is already running/done
 
         # since ws.run_forver() runs an infinite loop, everything below that line wouldn't execute
         # solution: run it in a thread, i.e. in a parallel background task.
-        t = threading.Thread(target=self._start_ws)
+        # daemon=True: the thread doesn't keep the program alive when the main window is closed
+        self._ws_thread = threading.Thread(target=self._start_ws, daemon=True)
         # self.start_ws() <-- alone wouldnt work
-        t.start()
+        self._ws_thread.start()
 
-        logger.info("Binance Futures Client sucessfully initialized")
+        logger.info("Binance Futures Client started")
+
+    def close(self, timeout: float = 5):
+        with self._ws_lock:
+            self._running = False  # stops the reconnect loop in _start_ws()
+            if self._ws is not None:
+                try:
+                    self._ws.close()  # makes run_forever() return
+                except Exception as e:
+                    logger.error(f"Binance error while closing websocket: {e}")
+        if self._ws_thread is not None:
+            self._ws_thread.join(timeout)
+            self._ws_thread = None
+
+        logger.info("Binance Futures Client closed")
 
     def _generate_signature(self, data: dict) -> str: #check if generic dict works, maybe "typing.Dict" needed that allows more complex variables in it
         #encode() turns strings into byte-objects (as expected by hmac)
@@ -96,6 +156,12 @@ class BinanceFuturesClient:
             except Exception as e:
                 logger.error(f"Connection error while making {method} request to {endpoint}: {e}")
                 return None
+        elif method == "PUT":  # used to modify (amend) an existing order in place
+            try:
+                response = requests.put(self._base_url + endpoint, params=data, headers=self._headers)
+            except Exception as e:
+                logger.error(f"Connection error while making {method} request to {endpoint}: {e}")
+                return None
         else:
             raise ValueError()
 
@@ -157,6 +223,21 @@ class BinanceFuturesClient:
 
             return self.prices[contract.symbol]
 
+    def get_open_interest(self, contract: Contract) -> float:
+        # https://binance-docs.github.io/apidocs/futures/en/#open-interest
+        # binance has no websocket stream for open interest, so this is the only way to get it (one symbol per request)
+        data = dict()
+        data['symbol'] = contract.symbol
+
+        oi_data = self._make_request("GET", "/fapi/v1/openInterest", data)
+
+        if oi_data is not None:
+            derivatives_data = DerivativesData(oi_data, 'binance')
+            self.derivatives.update(derivatives_data)  # stored next to the mark price updates
+            self.screener.on_derivatives(contract.symbol, open_interest=derivatives_data.open_interest)
+
+            return derivatives_data.open_interest
+
     def get_balances(self) -> dict[str, Balance]:
         data = dict()
         data['timestamp'] = int(time.time()*1000)
@@ -187,6 +268,10 @@ class BinanceFuturesClient:
         if tif is not None:
             data['timeInForce'] = tif
 
+        # pre-trade risk check (risk.py), in memory, before anything is signed or sent
+        if self.risk is not None and not self.risk.check_order(contract, side, data['quantity'], data.get('price')):
+            return None
+
         data['timestamp'] = int(time.time()*1000)
         data['signature'] = self._generate_signature(data)
 
@@ -212,6 +297,60 @@ class BinanceFuturesClient:
 
         return order_status
 
+    def cancel_all_orders(self, contract=None) -> list[OrderStatus]:
+        # https://binance-docs.github.io/apidocs/futures/en/#cancel-all-open-orders-trade
+        # binance can only cancel all orders of ONE symbol per request, so first look up which symbols have open orders
+        data = dict()
+        if contract is not None:
+            data['symbol'] = contract.symbol
+        data['timestamp'] = int(time.time()*1000)
+        data['signature'] = self._generate_signature(data)
+
+        open_orders = self._make_request('GET', '/fapi/v1/openOrders', data)
+        if open_orders is None:
+            return None
+
+        cancelled = []
+        for symbol in set(o['symbol'] for o in open_orders):
+            data = dict()
+            data['symbol'] = symbol
+            data['timestamp'] = int(time.time()*1000)
+            data['signature'] = self._generate_signature(data)
+
+            if self._make_request('DELETE', '/fapi/v1/allOpenOrders', data) is not None:
+                # the answer is only {"code": 200, "msg": ...}, so the order info comes from the open orders above
+                for o in open_orders:
+                    if o['symbol'] == symbol:
+                        order_status = OrderStatus(o, 'binance')
+                        order_status.status = 'CANCELED'
+                        cancelled.append(order_status)
+
+        return cancelled
+
+    def modify_order(self, contract: Contract, order_id: int, side: str, quantity: float, price: float) -> OrderStatus:
+        # https://binance-docs.github.io/apidocs/futures/en/#modify-order-trade
+        # changes price/quantity of a working LIMIT order in one request, instead of cancel_order() + place_order()
+        # (two round trips, and in between we would have no order in the market at all)
+        data = dict()
+        data['orderId'] = order_id
+        data['symbol'] = contract.symbol
+        data['side'] = side  # binance wants the side again, even though it cannot be changed
+        data['quantity'] = round(round(quantity / contract.lot_size) * contract.lot_size, 8)
+        data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
+
+        if self.risk is not None and not self.risk.check_order(contract, side, data['quantity'], data['price'], order_id):
+            return None
+
+        data['timestamp'] = int(time.time()*1000)
+        data['signature'] = self._generate_signature(data)
+
+        order_status = self._make_request('PUT', '/fapi/v1/order', data)
+
+        if order_status is not None:
+            order_status = OrderStatus(order_status, 'binance')
+
+        return order_status
+
     def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
 
         data = dict()
@@ -222,27 +361,75 @@ class BinanceFuturesClient:
 
         order_status = self._make_request("GET", "/fapi/v1/order", data)
 
+        if order_status is not None:
+            order_status = OrderStatus(order_status, 'binance')
+
         return order_status
 
+    def get_open_orders(self, contract: Contract) -> list[OrderStatus]:
+        # https://binance-docs.github.io/apidocs/futures/en/#current-all-open-orders-user_data
+        # all open orders of one symbol in one request (used by the OrderManager polling instead of one request per order)
+        data = dict()
+        data['timestamp'] = int(time.time() * 1000)
+        data['symbol'] = contract.symbol
+        data['signature'] = self._generate_signature(data)
+
+        open_orders = self._make_request("GET", "/fapi/v1/openOrders", data)
+
+        if open_orders is not None:
+            open_orders = [OrderStatus(o, 'binance') for o in open_orders]
+
+        return open_orders
+
+    def get_positions(self) -> dict[str, float]:
+        # https://binance-docs.github.io/apidocs/futures/en/#position-information-v2-user_data
+        # net position (in base asset, + long / - short) of every symbol (one-way mode)
+        data = dict()
+        data['timestamp'] = int(time.time() * 1000)
+        data['signature'] = self._generate_signature(data)
+
+        position_data = self._make_request("GET", "/fapi/v2/positionRisk", data)
+
+        positions = None
+        if position_data is not None:
+            positions = dict()
+            for p in position_data:
+                positions[p['symbol']] = positions.get(p['symbol'], 0) + float(p['positionAmt'])  # hedge mode: LONG + SHORT legs
+
+        return positions
+
 
     def _start_ws(self):
         # websocket connection using websocket-client module
         self._ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
         on_error=self._on_error, on_message=self._on_message)  # declared as instance variable, since we use it across many methods
 
-        while True:  # By putting run_forever() in infinite while loop, it will restart if connection is interrupted.
-                     # Because any websocket error will trigger except statement, after which code continues
+        while self._running:  # By putting run_forever() in a while loop, it will restart if connection is interrupted.
+                              # Because any websocket error will trigger except statement, after which code continues
+                              # close() sets _running to False, then we leave the loop instead of reconnecting
+            with self._ws_lock:
+                if not self._running:  # close() was called while we were sleeping/reconnecting
+                    break
             try:
-                self._ws.run_forever()  # check above under __init__ how to deal with this infinite loop problem in python
+                self._ws.run_forever()  # check above under start() how to deal with this infinite loop problem in python
             except Exception as e:
-                logger.error("Binance error in run_forever() method: {e}")
-            time.sleep(2) # if connection cannot be restarted immediately, prevents continuously trying
+                logger.error(f"Binance error in run_forever() method: {e}")
+            if self._running:
+                time.sleep(2) # if connection cannot be restarted immediately, prevents continuously trying
     
     # below functions that are called "callback functions"
     def _on_open(self):  #some versions may need "ws" as input argument here
         logger.info("Binance connection opened")
 
+        # close() came between the check in _start_ws() and the connection being established: ws.close() did nothing then
+        if not self._running:
+            self._ws.close()
+            return
+
         self.subscribe_channel(list(self.contracts.values()), 'bookTicker')  #not sure why its contracts.values here and not keys...
+        self.subscribe_channel(list(self.contracts.values()), 'aggTrade')  # trades, gives the screener its rolling (e.g. 1h) volume
+        self.subscribe_channel([], '!ticker@arr')  # 24h statistics of ALL symbols in a single stream, for the screener
+        self.subscribe_channel([], '!markPrice@arr@1s')  # mark price, index price and funding rate of ALL symbols, every second
 
     def _on_close(self):
         logger.warning("Binance websocket connection closed")
@@ -259,6 +446,17 @@ class BinanceFuturesClient:
 
         data = json.loads(msg) # does the opposite of dumps() turns it into dict
 
+        # the all-market stream !ticker@arr sends a list of 24hrTicker dicts (one per symbol that changed), not a dict
+        # https://binance-docs.github.io/apidocs/futures/en/#all-market-tickers-streams
+        if isinstance(data, list):
+            for d in data:
+                if d.get('e') == "24hrTicker":
+                    # c=last price, P=price change percent, v=volume in base asset, q=volume in quote asset
+                    self.screener.on_ticker_24h(d['s'], float(d['c']), float(d['P']), float(d['v']), float(d['q']))
+                elif d.get('e') == "markPriceUpdate":  # from !markPrice@arr@1s
+                    self._on_mark_price(d)
+            return
+
         # create a clean feed of only bid and ask prices for the given symbol:
         if "e" in data:
             if data['e'] == "bookTicker":
@@ -276,6 +474,20 @@ class BinanceFuturesClient:
                 
                 # print(self.prices[symbol])
 
+                self.screener.on_book(symbol, bid_data, ask_data, data['E'] / 1000)  # E is the event time in ms
+
+            elif data['e'] == "markPriceUpdate":  # single symbol stream, e.g. subscribe_channel([contract], 'markPrice@1s')
+                self._on_mark_price(data)
+
+            elif data['e'] == "aggTrade":
+                # subscribed for all contracts in _on_open()
+                self.screener.on_trade(data['s'], float(data['p']), float(data['q']), data['T'] / 1000)
+
+    def _on_mark_price(self, data: dict):
+        derivatives_data = DerivativesData(data, 'binance')
+        self.derivatives.update(derivatives_data)
+        self.screener.on_derivatives(derivatives_data.symbol, derivatives_data.funding_rate)
+
     def subscribe_channel(self, contracts: list[Contract], channel: str):
         #https://binance-docs.github.io/apidocs/spot/en/#live-subscribing-unsubscribing-to-streams
         # expects a json object, i.e. in python we create a dict with expected parameters
@@ -285,6 +497,8 @@ class BinanceFuturesClient:
 
         for contract in contracts:
             data['params'].append(contract.symbol.lower() + "@" + channel)  # e.g. channel "btcusdt@bookTicker" must be lowercase symbols
+        if len(contracts) == 0:
+            data['params'].append(channel)  # streams that are not per symbol, e.g. "!ticker@arr"
         data['id'] = self._ws_id
 
         # print(data, type(data))
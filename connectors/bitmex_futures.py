@@ -13,6 +13,9 @@ import json
 import threading
 
 from models import *
+from screener import Screener
+from timeseries import DerivativesStore
+from connectors.bootstrap import LazyRequest
 
 logger = logging.getLogger()
 
@@ -32,6 +35,8 @@ testnet account under my protonmail
 class BitmexFuturesClient:
 
     def __init__(self, public_key: str, secret_key: str, testnet: bool):
+        self.platform = 'bitmex'
+
         if testnet:
             self._base_url = 'https://testnet.bitmex.com/api/v1'
             self._wss_url = 'wss://testnet.bitmex.com/realtime'
@@ -42,19 +47,75 @@ class BitmexFuturesClient:
         self._public_key = public_key
         self._secret_key = secret_key
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        # no network calls in here, see start() and the lazy contracts/balances properties below
+        self._contracts = LazyRequest(self.get_contracts)
+        self._balances = LazyRequest(self.get_balances)
 
         self.prices = dict()
+        self.screener = Screener()  # rolling statistics of all contracts, fed by the websocket
+        self.derivatives = DerivativesStore()  # mark/index price, funding rate and open interest history per symbol
+        self.risk = None  # optional RiskEngine (risk.py)
+        self.order_manager = None  # optional OrderManager (order_manager.py), sets itself here
 
         self._ws = None
-
-        # t = threading.Thread(target=self._start_ws)
-        # t.start()
+        self._ws_thread = None
+        self._running = False
+        self._ws_lock = threading.Lock()  # shared by _start_ws() and close()
 
         logger.info("Bitmex Client successfully initialized")
 
 
+    @property
+    def contracts(self) -> dict[str, Contract]:
+        return self._contracts.get()  # waits if the request is still running
+
+    @contracts.setter
+    def contracts(self, value: dict[str, Contract]):
+        self._contracts.set(value)
+
+
+    @property
+    def balances(self) -> dict[str, Balance]:
+        return self._balances.get()
+
+    @balances.setter
+    def balances(self, value: dict[str, Balance]):
+        self._balances.set(value)
+
+
+    def pending_requests(self) -> list:
+        return [f for f in (self._contracts.pending(), self._balances.pending()) if f is not None]
+
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+
+        self._contracts.future()  # sends the request in the background, unless it is already running/done
+        self._balances.future()  # sends the request in the background, unless it is already running/done
+
+        self._ws_thread = threading.Thread(target=self._start_ws, daemon=True)
+        self._ws_thread.start()
+
+        logger.info("Bitmex Client started")
+
+
+    def close(self, timeout: float = 5):
+        with self._ws_lock:
+            self._running = False
+            if self._ws is not None:
+                try:
+                    self._ws.close()
+                except Exception as e:
+                    logger.error(f"Bitmex error while closing websocket: {e}")
+        if self._ws_thread is not None:
+            self._ws_thread.join(timeout)
+            self._ws_thread = None
+
+        logger.info("Bitmex Client closed")
+
+
      
     def _add_headers(self, method, endpoint, data) -> str:
         '''
@@ -121,6 +182,13 @@ class BitmexFuturesClient:
             except Exception as e:
                 logger.error(f"Connection error while making {method} request to {endpoint}: {e}")
                 return None
+        elif method == "PUT":  # amend an existing order
+            try:
+                response = requests.put(self._base_url + endpoint, params=data,
+                headers=self._add_headers(method, endpoint, data))
+            except Exception as e:
+                logger.error(f"Connection error while making {method} request to {endpoint}: {e}")
+                return None
         else:
             raise ValueError()
         
@@ -189,6 +257,10 @@ class BitmexFuturesClient:
         if tif is not None:
             data['timeInForce'] = tif
 
+        # pre-trade risk check (risk.py), before the request is signed in _make_requests()
+        if self.risk is not None and not self.risk.check_order(contract, side, data['orderQty'], data.get('price')):
+            return None
+
         order_status = self._make_requests('POST', '/order', data)
         # print(order_status) 
 
@@ -209,36 +281,112 @@ class BitmexFuturesClient:
 
         return order_status
 
+    def cancel_all_orders(self, contract=None) -> list[OrderStatus]:
+        # https://www.bitmex.com/api/explorer/#!/Order/Order_cancelAll
+        # one request for all symbols (or only the given one)
+        data = {}
+        if contract is not None:
+            data['symbol'] = contract.symbol
+
+        order_status = self._make_requests('DELETE', '/order/all', data)
+
+        if order_status is not None:
+            order_status = [OrderStatus(o, 'bitmex') for o in order_status]
+
+        return order_status
+
+    def modify_order(self, contract: Contract, order_id: str, quantity=None, price=None) -> OrderStatus:
+        # https://www.bitmex.com/api/explorer/#!/Order/Order_amend
+        # amends the order in place (keeps the orderID), so there is no gap without an order in the market
+        data = {}
+        data['orderID'] = order_id
+
+        if quantity is not None:
+            data['orderQty'] = round(round(quantity / contract.lot_size) * contract.lot_size, 8)
+        if price is not None:
+            data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
+
+        # side is not known here, the risk engine takes it from the OrderManager's copy of the order
+        if self.risk is not None and not self.risk.check_order(contract, None, data.get('orderQty'), data.get('price'), order_id):
+            return None
+
+        order_status = self._make_requests('PUT', '/order', data)
+        # unlike cancel_order(), the amend endpoint returns a single order and not a list
+
+        if order_status is not None:
+            order_status = OrderStatus(order_status, 'bitmex')
+
+        return order_status
+
     def get_order_status(self, order_id: str, contract: Contract) -> OrderStatus:
-        # Cant pass order_id, have to first get list of all orders for given symbol.
+        # Cant pass order_id directly, but the 'filter' parameter (a json string) can select it.
+        # Without it, /order returns only the OLDEST 100 orders of the symbol, which usually don't contain our order
         data = {}
         data['symbol'] = contract.symbol
+        data['filter'] = json.dumps({'orderID': order_id})
 
         order_status = self._make_requests('GET', '/order', data)
 
         if order_status is not None:
             for order in order_status:
                 if order['orderID'] == order_id:
-                    return OrderStatus(order_status[0], 'bitmex') 
+                    return OrderStatus(order, 'bitmex')
+
+    def get_open_orders(self, contract: Contract) -> list[OrderStatus]:
+        # all open orders of one symbol in one request (used by the OrderManager polling instead of one request per order)
+        data = {}
+        data['symbol'] = contract.symbol
+        data['filter'] = json.dumps({'open': True})
+        data['count'] = 500  # max. per api call
+        data['reverse'] = True  # newest first
+
+        open_orders = self._make_requests('GET', '/order', data)
+
+        if open_orders is not None:
+            open_orders = [OrderStatus(o, 'bitmex') for o in open_orders]
+
+        return open_orders
+
+    def get_positions(self) -> dict[str, float]:
+        # https://www.bitmex.com/api/explorer/#!/Position/Position_get
+        # net position (in contracts, + long / - short) of every symbol, e.g. to start the risk engine from the real positions
+        position_data = self._make_requests('GET', '/position', dict())
+
+        positions = None
+        if position_data is not None:
+            positions = {}
+            for p in position_data:
+                positions[p['symbol']] = p['currentQty']
+
+        return positions
 
 
     def _start_ws(self):
         self._ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
         on_error=self._on_error, on_message=self._on_message)
 
-        while True:  # By putting run_forever() in infinite while loop, it will restart if connection is interrupted.
-                     # Because any websocket error will trigger except statement, after which code continues
+        while self._running:  # restarts if connection is interrupted, until close() is called
+            with self._ws_lock:
+                if not self._running:  # close() was called while reconnecting
+                    break
             try:
-                self._ws.run_forever()  # check above under __init__ how to deal with this infinite loop problem in python
+                self._ws.run_forever()
             except Exception as e:
-                logger.error("Bitmex error in run_forever() method: {e}")
-            time.sleep(2)
+                logger.error(f"Bitmex error in run_forever() method: {e}")
+            if self._running:
+                time.sleep(2)
 
 
     def _on_open(self):  #some versions may need "ws" as input argument here
         logger.info("Bitmex connection opened")
 
+        # close() came before the connection was established, ws.close() did nothing then
+        if not self._running:
+            self._ws.close()
+            return
+
         self.subscribe_channel('instrument')
+        self.subscribe_channel('trade')  # all trades of all instruments, gives the screener its traded volume
 
 
     def _on_close(self):
@@ -267,7 +415,24 @@ class BitmexFuturesClient:
                     if 'askPrice' in d:
                         self.prices[symbol]['ask'] = d['askPrice']
 
-                    print(symbol, self.prices[symbol])
+                    logger.debug(f"{symbol} {self.prices[symbol]}")  # runs on every instrument update, print() would flood the console
+
+                    self.screener.on_book(symbol, self.prices[symbol]['bid'], self.prices[symbol]['ask'])
+                    # lastChangePcnt is a fraction (0.01 = 1%), the screener works in percent like binance
+                    self.screener.on_ticker_24h(symbol, d.get('lastPrice'),
+                                                d['lastChangePcnt'] * 100 if d.get('lastChangePcnt') is not None else None,
+                                                d.get('homeNotional24h'), d.get('foreignNotional24h'))
+
+                    # the same instrument updates also contain mark price, index price, funding rate and open interest
+                    if any(k in d for k in ('markPrice', 'indicativeSettlePrice', 'fundingRate', 'openInterest')):
+                        derivatives_data = DerivativesData(d, 'bitmex')
+                        self.derivatives.update(derivatives_data)
+                        self.screener.on_derivatives(symbol, derivatives_data.funding_rate, derivatives_data.open_interest)
+
+            elif data['table'] == 'trade':
+                for d in data['data']:
+                    # homeNotional = size in base asset (e.g. BTC), size would be in number of contracts
+                    self.screener.on_trade(d['symbol'], d['price'], d.get('homeNotional', d['size']))
 
 
 
@@ -0,0 +1,97 @@
+#%%
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger()
+
+'''
+Helpers to start the exchange clients without blocking the UI.
+
+Creating a BinanceFuturesClient / BitmexFuturesClient does no network calls anymore.
+client.start() fires the REST requests (contracts, balances) in background threads and starts the websocket,
+so starting several clients one after another still loads all exchanges in parallel.
+client.contracts / client.balances wait for the answer only when they are accessed for the first time.
+'''
+
+
+def run_in_background(func, *args) -> Future:
+    # like ThreadPoolExecutor.submit(), but with a daemon thread: a hanging request never keeps the program from exiting
+    future = Future()
+
+    def worker():
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            logger.error(f"Error in background call {func.__name__}: {e}")
+            future.set_exception(e)
+
+    threading.Thread(target=worker, daemon=True).start()
+    return future
+
+
+def resolved(value) -> Future:
+    # a future that is already done, e.g. for client.contracts = {...} in tests
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class LazyRequest:
+    '''
+    Result of a REST request (e.g. get_contracts) that is only sent when needed, and only once at a time.
+    The lock makes sure that the UI thread, the websocket thread (_on_open) and start() don't each send their own request.
+    A failed or empty answer is not kept: the next access sends the request again.
+    '''
+    def __init__(self, request):
+        self._request = request
+        self._future = None
+        self._fixed = False  # True when the value was set by hand (e.g. in tests), then it is never requested again
+        self._lock = threading.Lock()
+
+    def future(self) -> Future:
+        with self._lock:
+            if self._future is None or (not self._fixed and self._future.done() and _failed(self._future)):
+                self._future = run_in_background(self._request)
+            return self._future
+
+    def get(self):
+        return self.future().result()  # waits if the request is still running
+
+    def set(self, value):
+        with self._lock:
+            self._future = resolved(value)
+            self._fixed = True
+
+    def pending(self):
+        # the current future without starting a request, None if nothing was requested yet
+        return self._future
+
+
+def _failed(future: Future) -> bool:
+    # get_contracts()/get_balances() log errors and return an empty dict instead of raising
+    return future.exception() is not None or not future.result()
+
+
+def start_clients(clients: list) -> list:
+    for client in clients:
+        client.start()  # returns immediately, see above
+    return clients
+
+
+def wait_until_ready(clients: list, timeout=None) -> bool:
+    # optional: blocks until contracts and balances of all clients are loaded (or timeout in seconds is over)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for client in clients:
+        for future in client.pending_requests():
+            try:
+                future.result(None if deadline is None else max(deadline - time.monotonic(), 0))
+            except Exception:  # timeout, or the request itself failed
+                return False
+    return True
+
+
+def close_clients(clients: list):
+    for client in clients:
+        client.close()
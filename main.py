@@ -4,6 +4,7 @@ import logging
 # from connectors.bitmex_futures import get_contracts
 from connectors.binance_futures import BinanceFuturesClient
 from connectors.bitmex_futures import BitmexFuturesClient
+from connectors.bootstrap import start_clients, close_clients
 
 # %%
 # logger setup
@@ -54,12 +55,14 @@ if __name__ == '__main__':
 
     # ================================================================
 
-    bitmex = BitmexFuturesClient(bitmex_public_key, bitmex_secret_key, True)
+    bitmex = BitmexFuturesClient(bitmex_public_key, bitmex_secret_key, True)  # no network calls yet
+    clients = [bitmex]  # add binance here when it is used again
+    start_clients(clients)  # loads contracts/balances of all exchanges in parallel in the background, doesn't block the UI
     # print(bitmex.place_order('ETHUSD', 'Buy', 10, 100))
     # printing out Balance/Contract objects doesnt work, but we can try accessing some contents to test:
     # print(bitmex.contracts['XBTUSD'].base_asset, bitmex.contracts['XBTUSD'].price_decimals)
     # print(bitmex.balances['XBt'].wallet_balance)  #Bt : because bitmex returns satoshis 
-    print(bitmex.place_order(bitmex.contracts['XBTUSD'], 'Limit', 100.4, 'Buy', price=20000.343432, tif='GoodTillCancel'))
+    # print(bitmex.place_order(bitmex.contracts['XBTUSD'], 'Limit', 100.4, 'Buy', price=20000.343432, tif='GoodTillCancel'))  # would wait for contracts before the UI shows up
     # print(bitmex.get_order_status('cd749f22-077a-4f8e-99e0-c6571628621a', bitmex.contracts['XBTUSD']))  #its ok if it returns an "models.Orderstatus object without error"
     # print(bitmex.cancel_order('cd749f22-077a-4f8e-99e0-c6571628621a').status) 
     # bitmex.get_historical_candles(bitmex.contracts['XBTUSD'], '1h')
@@ -88,4 +91,6 @@ if __name__ == '__main__':
 
     root.mainloop()
 
+    close_clients(clients)  # window was closed: stop websockets so the program can exit
+
 # %%
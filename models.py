@@ -62,6 +62,12 @@ def tick_to_decimals(tick_size: float) -> int:
         return 0 #no decimals
 
 
+def round_to_step(value: float, step: float) -> float:
+    # snaps a price/quantity onto the exchange grid (tick_size or lot_size), same formula as in the connectors' place_order()
+    # last round() removes floating point noise like 0.30000000000000004
+    return round(round(value / step) * step, 8)
+
+
 class Contract:
     def __init__(self, contract_info, exchange):
         if exchange =='binance':
@@ -72,6 +78,10 @@ class Contract:
             self.quantity_decimals = contract_info['quantityPrecision']
             self.tick_size = 1/pow(10, contract_info['pricePrecision']) #e.g. when precision is 3 decimals, divide by 1000
             self.lot_size = 1/pow(10, contract_info['quantityPrecision'])
+            self.inverse = False  # binance USDT futures are linear: quantity is in base asset
+            self.quanto = False
+            self.multiplier = 1
+            self.base_per_contract = 1  # quantity is already in base asset
         elif exchange == 'bitmex':
             self.symbol = contract_info['symbol']
             self.base_asset = contract_info['rootSymbol']
@@ -80,6 +90,14 @@ class Contract:
             self.quantity_decimals = tick_to_decimals(contract_info['lotSize'])
             self.tick_size = contract_info['tickSize']
             self.lot_size = contract_info['lotSize']
+            self.inverse = contract_info['isInverse']  # e.g. XBTUSD: quantity is in USD (quote), not in BTC
+            self.quanto = contract_info['isQuanto']  # e.g. ETHUSD: value is paid in XBT, price * multiplier satoshis per contract
+            self.multiplier = contract_info['multiplier']
+            # linear contracts count orderQty in contracts, e.g. XBTUSDT: underlyingToPositionMultiplier = 1000000 --> 1 contract = 0.000001 XBT
+            if contract_info.get('underlyingToPositionMultiplier') is not None:
+                self.base_per_contract = 1 / contract_info['underlyingToPositionMultiplier']
+            else:
+                self.base_per_contract = None  # unknown, the risk engine won't compute a notional for it
 
 class OrderStatus:
     def __init__(self, order_info, exchange):
@@ -87,7 +105,47 @@ class OrderStatus:
             self.order_id = order_info['orderId']
             self.status = order_info['status']
             self.avg_price = float(order_info['avgPrice'])
+            self.executed_qty = float(order_info['executedQty'])  # filled part of the order
         if exchange =='bitmex':
             self.order_id = order_info['orderID']
             self.status = order_info['ordStatus']
-            self.avg_price = order_info['avgPx']
\ No newline at end of file
+            self.avg_price = order_info['avgPx']
+            self.executed_qty = order_info['cumQty']
+
+class DerivativesData:
+    # mark price, index price, funding rate and open interest of one contract at one point in time
+    # fields that were not part of the update are None (bitmex only sends what changed, binance has no open interest stream)
+    def __init__(self, info, exchange):
+        if exchange == 'binance' and 'openInterest' in info:
+            # answer of the REST endpoint /fapi/v1/openInterest, binance has no websocket stream for it
+            self.symbol = info['symbol']
+            self.timestamp = info['time']
+            self.mark_price = None
+            self.index_price = None
+            self.funding_rate = None
+            self.next_funding_time = None
+            self.open_interest = float(info['openInterest'])
+        elif exchange == 'binance':
+            # markPriceUpdate event: https://binance-docs.github.io/apidocs/futures/en/#mark-price-stream
+            self.symbol = info['s']
+            self.timestamp = info['E']  # event time in ms
+            self.mark_price = float(info['p'])
+            self.index_price = float(info['i'])
+            self.funding_rate = float(info['r']) if info['r'] != '' else None  # empty for delivery contracts
+            self.next_funding_time = info['T'] if info['T'] != 0 else None
+            self.open_interest = None
+        elif exchange == 'bitmex':
+            # (partial) row of the instrument table
+            self.symbol = info['symbol']
+            if 'timestamp' in info:
+                self.timestamp = int(dateutil.parser.isoparse(info['timestamp']).timestamp() * 1000)
+            else:
+                self.timestamp = None
+            self.mark_price = info.get('markPrice')
+            self.index_price = info.get('indicativeSettlePrice')
+            self.funding_rate = info.get('fundingRate')
+            if info.get('fundingTimestamp') is not None:
+                self.next_funding_time = int(dateutil.parser.isoparse(info['fundingTimestamp']).timestamp() * 1000)
+            else:
+                self.next_funding_time = None
+            self.open_interest = info.get('openInterest')
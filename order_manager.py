@@ -0,0 +1,332 @@
+#%%
+import logging
+import time
+import collections
+import statistics
+import threading
+
+from models import *
+
+logger = logging.getLogger()
+
+'''
+Sits on top of BinanceFuturesClient / BitmexFuturesClient, so that we don't have to keep track of order IDs ourselves.
+
+- working orders are kept in a local "book", indexed by order id, by symbol and by (symbol, side)
+  --> "what are my open buys on XBTUSD?" is a dict lookup, not a loop over all orders
+- prices/quantities are rounded to the Contract's tick_size/lot_size BEFORE we compare or send anything
+- changing price/quantity uses the native amend endpoints (binance PUT /fapi/v1/order, bitmex PUT /order)
+  instead of cancel_order() + place_order(): one round trip, and the order never leaves the market
+- identical requests (same price/quantity as what is already working) are not sent again
+- every request is timed, see latency_stats()
+- start_polling() checks the working orders in the background, so fills of resting orders reach the risk engine
+'''
+
+# statuses after which an order can never be filled anymore (compared in lower case, binance uses FILLED, bitmex Filled)
+TERMINAL_STATUSES = {'filled', 'canceled', 'cancelled', 'expired', 'rejected'}
+
+
+class WorkingOrder:
+    # our own local copy of an order, the exchange's answer (OrderStatus) only contains id/status/avg_price/executed_qty
+    def __init__(self, order_id, contract: Contract, side: str, quantity: float, order_type: str, price=None, tif=None):
+        self.order_id = order_id
+        self.contract = contract
+        self.side = side  # always lower case 'buy'/'sell' here, converted to exchange format when sending
+        self.quantity = quantity
+        self.order_type = order_type
+        self.price = price
+        self.tif = tif
+        self.status = None
+        self.filled_quantity = 0.0
+        self.avg_price = None  # average price of the filled part
+
+
+class OrderManager:
+    def __init__(self, client, max_latency_samples: int = 1000):
+        self.client = client  # BinanceFuturesClient or BitmexFuturesClient, told apart by client.platform
+
+        self.orders: dict[str, WorkingOrder] = dict()  # order_id -> order
+        # dicts used as ordered sets (values are the same WorkingOrder objects as above, no copies)
+        self._by_symbol: dict[str, dict] = dict()  # symbol -> {order_id: order}
+        self._by_side: dict[tuple, dict] = dict()  # (symbol, 'buy'/'sell') -> {order_id: order}
+
+        # order-to-ack latency (seconds) of the last requests, deque drops the oldest sample automatically
+        self.latencies = collections.deque(maxlen=max_latency_samples)
+
+        # the book is changed both by the caller and by the polling thread
+        self._lock = threading.RLock()
+        self._polling = False
+        self._poll_thread = None
+
+        client.order_manager = self  # lets the risk engine's kill() update this book after cancelling everything
+
+    # ---------- local book ----------
+
+    def _add(self, order: WorkingOrder):
+        with self._lock:
+            self.orders[order.order_id] = order
+            self._by_symbol.setdefault(order.contract.symbol, dict())[order.order_id] = order
+            self._by_side.setdefault((order.contract.symbol, order.side), dict())[order.order_id] = order
+
+    def _remove(self, order: WorkingOrder):
+        with self._lock:
+            self.orders.pop(order.order_id, None)
+            self._by_symbol.get(order.contract.symbol, dict()).pop(order.order_id, None)
+            self._by_side.get((order.contract.symbol, order.side), dict()).pop(order.order_id, None)
+
+    def _update_status(self, order: WorkingOrder, order_status: OrderStatus):
+        # under the lock, otherwise the caller and the polling thread could both count the same fill
+        with self._lock:
+            order.status = order_status.status
+
+            # new fills since the last update are passed on to the risk engine (risk.py), which keeps the positions
+            new_fill = order_status.executed_qty - order.filled_quantity
+            if new_fill > 0:
+                # the exchange only gives the average price of everything filled so far, the price of the new part is the difference
+                fill_price = order_status.avg_price or order.price
+                if order_status.avg_price and order.avg_price:
+                    fill_price = (order_status.avg_price * order_status.executed_qty - order.avg_price * order.filled_quantity) / new_fill
+                order.filled_quantity = order_status.executed_qty
+                order.avg_price = order_status.avg_price
+                if self.client.risk is not None:
+                    self.client.risk.on_fill(order.contract, order.side, new_fill, fill_price)
+
+            if order.status.lower() in TERMINAL_STATUSES:
+                self._remove(order)
+
+    def get_working_orders(self, symbol=None, side=None) -> list[WorkingOrder]:
+        with self._lock:
+            if symbol is None:
+                return list(self.orders.values())
+            if side is None:
+                return list(self._by_symbol.get(symbol, dict()).values())
+            return list(self._by_side.get((symbol, side.lower()), dict()).values())
+
+    def open_quantity(self, symbol: str, side: str, exclude=None) -> float:
+        # unfilled quantity of the working orders on one side, e.g. for the position limit of the risk engine
+        # exclude: id of an order that is being amended, its new quantity is checked instead
+        with self._lock:
+            total = 0.0
+            for order in self._by_side.get((symbol, side.lower()), dict()).values():
+                if order.order_id != exclude:
+                    total += order.quantity - order.filled_quantity
+            return total
+
+    def _find_duplicate(self, contract: Contract, side: str, quantity: float, price) -> WorkingOrder:
+        with self._lock:
+            for order in self._by_side.get((contract.symbol, side), dict()).values():
+                if order.quantity == quantity and order.price == price:
+                    return order
+            return None
+
+    # ---------- timing ----------
+
+    def _timed(self, func, *args, **kwargs):
+        start = time.perf_counter()  # perf_counter instead of time.time(): higher resolution, never jumps
+        result = func(*args, **kwargs)
+        # None = no acknowledgement (rejected by the risk check or request failed), not a real round trip
+        if result is not None:
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def latency_stats(self) -> dict[str, float]:
+        # in milliseconds, easier to read than seconds
+        if len(self.latencies) == 0:
+            return dict()
+        samples = sorted(self.latencies)
+        stats = dict()
+        stats['count'] = len(samples)
+        stats['mean_ms'] = statistics.mean(samples) * 1000
+        stats['median_ms'] = statistics.median(samples) * 1000
+        stats['p99_ms'] = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+        stats['max_ms'] = samples[-1] * 1000
+        return stats
+
+    # ---------- order actions ----------
+
+    def place_order(self, contract: Contract, side: str, quantity: float, order_type: str, price=None, tif=None) -> WorkingOrder:
+        side = side.lower()
+        quantity = round_to_step(quantity, contract.lot_size)
+        if price is not None:
+            price = round_to_step(price, contract.tick_size)
+        if tif is None and self.client.platform == 'binance' and order_type.upper() == 'LIMIT':
+            tif = 'GTC'  # binance rejects LIMIT orders without timeInForce
+
+        # under the lock, so that two threads placing the same order can't both miss the duplicate check
+        with self._lock:
+            duplicate = self._find_duplicate(contract, side, quantity, price)
+            if duplicate is not None:
+                logger.debug(f"Skipped duplicate {side} order {quantity} {contract.symbol} @ {price}, already working as {duplicate.order_id}")
+                return duplicate
+
+            # the two connectors have a different argument order (and casing of side), see their place_order()
+            if self.client.platform == 'binance':
+                order_status = self._timed(self.client.place_order, contract, side.upper(), quantity, order_type, price, tif)
+            else:
+                order_status = self._timed(self.client.place_order, contract, order_type, quantity, side, price, tif)
+
+            if order_status is None:
+                return None
+
+            order = WorkingOrder(order_status.order_id, contract, side, quantity, order_type, price, tif)
+            self._add(order)
+            self._update_status(order, order_status)  # removes it again if it is already done, e.g. a filled market order
+
+            return order
+
+    def amend_order(self, order_id, quantity=None, price=None) -> WorkingOrder:
+        # under the lock: the polling thread must not update/remove the order while we amend it
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                logger.warning(f"Cannot amend order {order_id}: not in the local book of working orders")
+                return None
+
+            contract = order.contract
+            if quantity is not None:
+                quantity = round_to_step(quantity, contract.lot_size)
+            if price is not None:
+                price = round_to_step(price, contract.tick_size)
+
+            # only send what actually changes, if nothing changes don't send anything
+            if quantity == order.quantity:
+                quantity = None
+            if price == order.price:
+                price = None
+            if quantity is None and price is None:
+                return order
+
+            if self.client.platform == 'binance':
+                # binance always wants both quantity and price
+                order_status = self._timed(self.client.modify_order, contract, order_id, order.side.upper(),
+                                           order.quantity if quantity is None else quantity,
+                                           order.price if price is None else price)
+            else:
+                order_status = self._timed(self.client.modify_order, contract, order_id, quantity, price)
+
+            if order_status is None:
+                return None
+
+            # amended in place, so the indexes (id, symbol, side) stay valid
+            if quantity is not None:
+                order.quantity = quantity
+            if price is not None:
+                order.price = price
+            self._update_status(order, order_status)
+
+            return order
+
+    def requote(self, contract: Contract, side: str, price: float, quantity=None, tif=None) -> WorkingOrder:
+        '''
+        Keeps ONE limit order on the given side at the given price.
+        If there is already a working order on that side it is amended in place (single request),
+        otherwise a new one is placed (then quantity is required).
+        '''
+        working = self.get_working_orders(contract.symbol, side)
+        if len(working) > 0:
+            return self.amend_order(working[0].order_id, quantity, price)
+
+        if quantity is None:
+            logger.warning(f"Cannot requote {side} {contract.symbol}: no working order and no quantity given")
+            return None
+
+        order_type = 'LIMIT' if self.client.platform == 'binance' else 'Limit'
+        return self.place_order(contract, side, quantity, order_type, price, tif)
+
+    def cancel_order(self, order_id) -> OrderStatus:
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                logger.warning(f"Cannot cancel order {order_id}: not in the local book of working orders")
+                return None
+
+            if self.client.platform == 'binance':
+                order_status = self._timed(self.client.cancel_order, order.contract, order_id)
+            else:
+                order_status = self._timed(self.client.cancel_order, order_id)
+
+            if order_status is not None:
+                self._update_status(order, order_status)  # also records fills that happened before the cancel
+                self._remove(order)
+
+            return order_status
+
+    def cancel_all(self, symbol=None):
+        for order in self.get_working_orders(symbol):  # get_working_orders() returns a copy, safe to remove while looping
+            self.cancel_order(order.order_id)
+
+    def refresh_order(self, order_id) -> WorkingOrder:
+        # asks the exchange for the current status, and drops filled/cancelled orders from the local book
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+
+        if self.client.platform == 'binance':
+            order_status = self.client.get_order_status(order.contract, order_id)
+        else:
+            order_status = self.client.get_order_status(order_id, order.contract)
+
+        if order_status is not None:
+            self._update_status(order, order_status)
+
+        return order
+
+    def on_cancel_all(self, order_statuses: list[OrderStatus]):
+        # called by RiskEngine.kill() with the answer of client.cancel_all_orders()
+        for order_status in order_statuses:
+            order = self.orders.get(order_status.order_id)
+            if order is not None:
+                self._update_status(order, order_status)
+                self._remove(order)
+
+        # orders that were not in the answer were already done on the exchange (e.g. filled), get their final status
+        for order in self.get_working_orders():
+            self.refresh_order(order.order_id)
+
+    # ---------- polling of resting orders ----------
+
+    def start_polling(self, interval: float = 2.0):
+        # a limit order that rests in the book and gets filled later is only noticed when we ask for its status,
+        # so this thread asks for the open orders of every symbol we have working orders on, every `interval` seconds.
+        # one request per symbol (not per order): bitmex allows only 120 REST requests per minute for the whole account
+        if self._polling:
+            return
+        self._polling = True
+        self._poll_thread = threading.Thread(target=self._poll, args=(interval,), daemon=True)
+        self._poll_thread.start()
+
+    def stop_polling(self):
+        self._polling = False
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+            self._poll_thread = None
+
+    def _poll(self, interval: float):
+        while self._polling:
+            with self._lock:
+                symbols = [symbol for symbol, orders in self._by_symbol.items() if len(orders) > 0]
+            for symbol in symbols:
+                try:
+                    self.refresh_symbol(symbol)
+                except Exception as e:
+                    logger.error(f"Error while polling orders of {symbol}: {e}")
+            time.sleep(interval)
+
+    def refresh_symbol(self, symbol: str):
+        # updates all working orders of one symbol with a single request for its open orders
+        working = self.get_working_orders(symbol)
+        if len(working) == 0:
+            return
+
+        open_orders = self.client.get_open_orders(working[0].contract)
+        if open_orders is None:  # request failed, try again next time
+            return
+
+        open_orders = {o.order_id: o for o in open_orders}
+        for order in working:
+            order_status = open_orders.get(order.order_id)
+            if order_status is not None:
+                self._update_status(order, order_status)  # still open, maybe partially filled
+            else:
+                # not open anymore (filled, cancelled, expired): only these need a request of their own for the final fill
+                self.refresh_order(order.order_id)
@@ -0,0 +1,200 @@
+#%%
+import logging
+
+from models import *
+
+logger = logging.getLogger()
+
+'''
+Pre-trade risk checks, done in memory right before an order is signed and sent (see place_order() in the connectors).
+
+Everything the check needs is kept here and updated in the background, no REST call on the order path:
+- per contract limits (max quantity, max notional, max position, allowed distance from the mid price),
+  precomputed once per contract so a check is only a few dict lookups and comparisons
+- positions, loaded once from the exchange (see sync()) and then updated from fills
+  (see on_fill(), called by the OrderManager, start its polling for resting orders)
+- available margin, from the Balance objects (see update_balances()), and then reduced/increased by the fills
+- the unfilled quantity of the working orders (OrderManager.open_quantity()) counts towards the position limit
+- the mid price comes from client.prices, which the websocket keeps up to date
+
+kill() blocks all new orders and cancels every open order with one batch request.
+
+Usage:
+    risk = RiskEngine(client, max_notional=1000, price_band=0.05, margin_asset='USDT')  # from now on every client.place_order() is checked
+    risk.sync()  # positions and margin from the exchange, call again from time to time to correct drift (fees, PnL)
+    risk.set_limits(client.contracts['BTCUSDT'], max_position=0.05)
+'''
+
+
+class ContractLimits:
+    def __init__(self, max_quantity=None, max_notional=None, max_position=None, price_band=None):
+        # None means "no limit"
+        self.max_quantity = max_quantity
+        self.max_notional = max_notional  # in quote asset, e.g. USDT for BTCUSDT, USD for XBTUSD
+        self.max_position = max_position  # absolute net position if the order and all working orders on its side fill, same unit as quantity
+        # price band precomputed as multipliers of the mid price, e.g. 0.05 -> order price must be within [0.95*mid, 1.05*mid]
+        if price_band is not None:
+            self.min_price_factor = 1 - price_band
+            self.max_price_factor = 1 + price_band
+        else:
+            self.min_price_factor = None
+            self.max_price_factor = None
+
+
+class RiskEngine:
+    def __init__(self, client, max_quantity=None, max_notional=None, max_position=None, price_band=0.05, margin_asset=None):
+        self.client = client
+        client.risk = self  # the connectors call self.risk.check_order() inline in place_order()/modify_order()
+
+        # defaults for every contract without its own set_limits()
+        self._default = dict(max_quantity=max_quantity, max_notional=max_notional,
+                             max_position=max_position, price_band=price_band)
+        self.limits: dict[str, ContractLimits] = dict()
+
+        self.positions: dict[str, float] = dict()  # symbol -> signed net position (+ long, - short)
+
+        # margin check only works when the margin is in the same asset as the notional (e.g. USDT on binance)
+        self.margin_asset = margin_asset
+        self.available_margin = None
+
+        self.killed = False
+
+    # ---------- state updates (not on the order path) ----------
+
+    def set_limits(self, contract: Contract, **limits):
+        # e.g. set_limits(contract, max_notional=500, price_band=0.02), missing ones use the defaults
+        values = dict(self._default)
+        values.update(limits)
+        self.limits[contract.symbol] = ContractLimits(**values)
+
+    def update_balances(self, balances: dict[str, Balance]):
+        if self.margin_asset is None or self.margin_asset not in balances:
+            return
+        balance = balances[self.margin_asset]
+        self.available_margin = balance.margin_balance - balance.initial_margin
+
+    def sync(self) -> bool:
+        # replaces the positions and the margin by what the exchange says (REST calls, not on the order path)
+        positions = self.client.get_positions()
+        if positions is None:
+            logger.warning("Risk: could not load the positions, keeping the local ones")
+            return False
+        self.positions = positions
+        self.update_balances(self.client.get_balances())
+        return True
+
+    def on_fill(self, contract: Contract, side: str, quantity: float, price=None):
+        symbol = contract.symbol
+        position = self.positions.get(symbol, 0)
+        new_position = position + quantity if side.lower() == 'buy' else position - quantity
+        self.positions[symbol] = new_position
+
+        # margin: a fill that increases the position uses margin, one that reduces it frees margin (same leverage 1 as check_order())
+        if self.available_margin is not None and price is not None and self._margin_in_quote(contract):
+            change = abs(new_position) - abs(position)
+            self.available_margin -= change * contract.base_per_contract * price
+
+    def _margin_in_quote(self, contract: Contract) -> bool:
+        # margin can only be tracked when the notional is in the margin asset (e.g. USDT on binance, not XBT on bitmex)
+        return (not contract.inverse and not contract.quanto and contract.base_per_contract is not None
+                and contract.quote_asset == self.margin_asset)
+
+    # ---------- the actual check (on the order path, keep it cheap) ----------
+
+    def check_order(self, contract: Contract, side, quantity, price=None, order_id=None) -> bool:
+        '''
+        Returns True if the order may be sent. side/quantity/price can be None (e.g. an amend that only changes the price),
+        then the checks that need them are skipped. Reasons for rejection are logged.
+        order_id is given for amends: quantity is then the new quantity of that order.
+        '''
+        if self.killed:
+            logger.warning(f"Risk: order on {contract.symbol} rejected, kill switch is active")
+            return False
+
+        limits = self.limits.get(contract.symbol)
+        if limits is None:
+            limits = ContractLimits(**self._default)
+            self.limits[contract.symbol] = limits  # computed once, reused for the next orders
+
+        mid = None
+        book = self.client.prices.get(contract.symbol)
+        if book is not None and book['bid'] is not None and book['ask'] is not None:
+            mid = (book['bid'] + book['ask']) / 2
+
+        # fat finger: limit price too far away from the market
+        if price is not None and limits.min_price_factor is not None:
+            if mid is None:
+                logger.warning(f"Risk: order on {contract.symbol} rejected, no live price to check {price} against")
+                return False
+            if price < mid * limits.min_price_factor or price > mid * limits.max_price_factor:
+                logger.warning(f"Risk: order on {contract.symbol} rejected, price {price} too far from mid {mid}")
+                return False
+
+        if quantity is None:
+            return True
+
+        if limits.max_quantity is not None and quantity > limits.max_quantity:
+            logger.warning(f"Risk: order on {contract.symbol} rejected, quantity {quantity} > {limits.max_quantity}")
+            return False
+
+        if contract.inverse:
+            notional = quantity  # inverse contracts (bitmex XBTUSD): quantity is already in quote currency
+        elif contract.quanto or contract.base_per_contract is None:
+            # quanto (bitmex ETHUSD) is valued in XBT, not in the quote asset: no notional in the unit of max_notional
+            if limits.max_notional is not None:
+                logger.warning(f"Risk: order on {contract.symbol} rejected, max_notional is not supported for quanto contracts, use max_quantity")
+                return False
+            notional = None
+        else:
+            reference_price = price if price is not None else mid  # market orders: use the mid
+            if reference_price is None:
+                logger.warning(f"Risk: order on {contract.symbol} rejected, no price to compute the notional")
+                return False
+            # base_per_contract: 1 on binance, e.g. 0.000001 for bitmex XBTUSDT where quantity is in contracts
+            notional = quantity * contract.base_per_contract * reference_price
+
+        if limits.max_notional is not None and notional is not None and notional > limits.max_notional:
+            logger.warning(f"Risk: order on {contract.symbol} rejected, notional {notional} > {limits.max_notional}")
+            return False
+
+        if notional is not None and self.available_margin is not None and self._margin_in_quote(contract):
+            if notional > self.available_margin:  # conservative: assumes leverage 1
+                logger.warning(f"Risk: order on {contract.symbol} rejected, notional {notional} > available margin {self.available_margin}")
+                return False
+
+        if limits.max_position is not None:
+            order_manager = self.client.order_manager
+            remaining = quantity
+            if order_id is not None and order_manager is not None:
+                order = order_manager.orders.get(order_id)
+                if order is not None:
+                    side = order.side  # bitmex amends don't send the side
+                    remaining = quantity - order.filled_quantity  # the filled part is already in the position
+            if side is not None:
+                # worst case: this order and every other working order on the same side get filled
+                if order_manager is not None:
+                    remaining += order_manager.open_quantity(contract.symbol, side, exclude=order_id)
+                position = self.positions.get(contract.symbol, 0)
+                position += remaining if side.lower() == 'buy' else -remaining
+                if abs(position) > limits.max_position:
+                    logger.warning(f"Risk: order on {contract.symbol} rejected, position would be {position} with all working orders filled")
+                    return False
+
+        return True
+
+    # ---------- kill switch ----------
+
+    def kill(self):
+        # blocks all new orders first, then cancels everything that is still open on the exchange
+        self.killed = True
+        logger.warning("Risk: kill switch activated, cancelling all open orders")
+        cancelled = self.client.cancel_all_orders()
+
+        # otherwise the OrderManager would still show the cancelled orders as working
+        if cancelled is not None and self.client.order_manager is not None:
+            self.client.order_manager.on_cancel_all(cancelled)
+
+        return cancelled
+
+    def reset(self):
+        self.killed = False
@@ -0,0 +1,257 @@
+#%%
+import logging
+import time
+import math
+import heapq
+import threading
+
+logger = logging.getLogger()
+
+'''
+Screener over the whole contract universe, fed by the websocket callbacks of the connectors (no REST polling).
+
+Instead of one object per contract, every statistic is one column (a plain list), and every contract is one row:
+    symbols:  ['BTCUSDT', 'ETHUSDT', ...]
+    mid:      [47230.1,   3410.2,    ...]
+    spread:   [0.00006,   0.0001,    ...]
+    ...
+so a ranked query is just one pass over a few lists + heapq, which is well below a millisecond for a few hundred contracts.
+
+Rolling statistics (return, volatility, traded volume) are computed over the last `window` buckets of `bucket_seconds`
+(default 60 x 1 minute = 1 hour). They are updated incrementally with running sums, nothing is recomputed from scratch.
+The rolling volume comes from the trade feeds (bitmex 'trade' table, binance 'aggTrade', both subscribed by the connectors);
+contracts that had no trade yet keep volume=None, so query() skips them instead of ranking them all at 0.
+'''
+
+# columns that can be used in query(sort_by=...) and as min_<column>/max_<column> filters
+COLUMNS = ['bid', 'ask', 'mid', 'spread', 'last_price', 'change_24h', 'volume_24h', 'quote_volume_24h',
+           'ret', 'volatility', 'volume', 'funding_rate', 'open_interest']
+
+
+class Screener:
+    def __init__(self, window: int = 60, bucket_seconds: int = 60):
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+
+        self.symbols: list[str] = []
+        self._index: dict[str, int] = dict()  # symbol -> row
+
+        # one list per column, see COLUMNS. None means "no data yet"
+        self.columns: dict[str, list] = {c: [] for c in COLUMNS}
+
+        # per row state of the rolling window (ring buffers of length window, _pos points at the oldest entry)
+        self._bucket = []  # id of the bucket currently being filled
+        self._pos = []
+        self._closes = []  # mid at the end of each bucket
+        self._returns = []  # log return of each bucket
+        self._volumes = []  # traded volume of each bucket
+        self._n_returns = []
+        self._sum_r = []
+        self._sum_r2 = []
+        self._current_volume = []  # volume of the bucket currently being filled
+        self._sum_volume = []  # volume of the closed buckets in the window
+        self._has_trades = []  # False until on_trade() was called: 'volume' stays None, not 0, without a trade feed
+
+        # updates come from the websocket thread, query() from the UI thread and rolls the windows too
+        self._lock = threading.RLock()
+
+    def add_contract(self, symbol: str) -> int:
+        with self._lock:
+            if symbol in self._index:
+                return self._index[symbol]
+
+            # query() may run at the same time in another thread (UI) and loops over range(len(self.symbols)),
+            # so all columns must be extended BEFORE the symbol becomes visible in self.symbols
+            row = len(self.symbols)
+            for column in self.columns.values():
+                column.append(None)
+
+            self._bucket.append(None)
+            self._pos.append(0)
+            self._closes.append([None] * self.window)
+            self._returns.append([0.0] * self.window)
+            self._volumes.append([0.0] * self.window)
+            self._n_returns.append(0)
+            self._sum_r.append(0.0)
+            self._sum_r2.append(0.0)
+            self._current_volume.append(0.0)
+            self._sum_volume.append(0.0)
+            self._has_trades.append(False)
+
+            self._index[symbol] = row
+            self.symbols.append(symbol)  # last, see above
+
+            return row
+
+    # ---------- rolling window ----------
+
+    def _roll(self, row: int, timestamp: float) -> bool:
+        # closes all buckets between the last update and now, i.e. moves the window forward. True if it moved
+        bucket = int(timestamp // self.bucket_seconds)
+        last_bucket = self._bucket[row]
+        if last_bucket is None:
+            self._bucket[row] = bucket
+            return False
+        if bucket <= last_bucket:
+            return False
+
+        mid = self.columns['mid'][row]
+        if bucket - last_bucket > self.window:
+            # nothing happened for longer than the whole window: every bucket in it is flat with no volume,
+            # the last bucket we have (and its volume/return) is older than the window and must not stay in the sums
+            self._closes[row] = [mid] * self.window
+            self._returns[row] = [0.0] * self.window
+            self._volumes[row] = [0.0] * self.window
+            self._pos[row] = 0
+            self._n_returns[row] = self.window
+            self._sum_r[row] = 0.0
+            self._sum_r2[row] = 0.0
+            self._sum_volume[row] = 0.0
+            self._current_volume[row] = 0.0
+            self._bucket[row] = bucket
+            self.columns['volatility'][row] = 0.0
+            if self._has_trades[row]:
+                self.columns['volume'][row] = 0.0
+            return True
+
+        for i in range(bucket - last_bucket):
+            pos = self._pos[row]
+            closes = self._closes[row]
+            # the close of the previous bucket sits just before the oldest entry in the ring buffer
+            previous_close = closes[pos - 1]
+
+            r = 0.0
+            if i == 0 and mid is not None and previous_close is not None and previous_close > 0:
+                r = math.log(mid / previous_close)  # later buckets of a gap had no ticks --> flat
+
+            # replace the oldest bucket with the new one, and keep the running sums up to date
+            old_r = self._returns[row][pos]
+            self._sum_r[row] += r - old_r
+            self._sum_r2[row] += r * r - old_r * old_r
+            self._returns[row][pos] = r
+            self._n_returns[row] = min(self._n_returns[row] + 1, self.window)
+
+            volume = self._current_volume[row] if i == 0 else 0.0
+            self._sum_volume[row] += volume - self._volumes[row][pos]
+            self._volumes[row][pos] = volume
+
+            closes[pos] = mid
+            self._pos[row] = (pos + 1) % self.window
+
+        self._current_volume[row] = 0.0
+        self._bucket[row] = bucket
+
+        n = self._n_returns[row]
+        if n > 1:
+            variance = (self._sum_r2[row] - self._sum_r[row] ** 2 / n) / (n - 1)
+            self.columns['volatility'][row] = math.sqrt(max(variance, 0.0))  # max() because of floating point errors around 0
+        if self._has_trades[row]:
+            self.columns['volume'][row] = self._sum_volume[row]
+        return True
+
+    def _update_return(self, row: int):
+        oldest_close = self._closes[row][self._pos[row]]
+        mid = self.columns['mid'][row]
+        if oldest_close is None:  # window not filled yet, compare with the first close we have
+            oldest_close = next((c for c in self._closes[row] if c is not None), None)
+        if oldest_close is not None and mid is not None and oldest_close > 0:
+            self.columns['ret'][row] = mid / oldest_close - 1
+
+    # ---------- updates (called from the websocket _on_message() of the connectors) ----------
+
+    def on_book(self, symbol: str, bid: float, ask: float, timestamp=None):
+        with self._lock:
+            if bid is None or ask is None:
+                return
+            row = self.add_contract(symbol)
+            self._roll(row, time.time() if timestamp is None else timestamp)
+
+            mid = (bid + ask) / 2
+            self.columns['bid'][row] = bid
+            self.columns['ask'][row] = ask
+            self.columns['mid'][row] = mid
+            if mid > 0:
+                self.columns['spread'][row] = (ask - bid) / mid  # relative spread, comparable across contracts
+
+            self._update_return(row)
+
+    def on_ticker_24h(self, symbol: str, last_price=None, change_24h=None, volume_24h=None, quote_volume_24h=None):
+        with self._lock:
+            # change_24h in percent, volume_24h in base asset, quote_volume_24h in quote asset
+            row = self.add_contract(symbol)
+            if last_price is not None:
+                self.columns['last_price'][row] = last_price
+            if change_24h is not None:
+                self.columns['change_24h'][row] = change_24h
+            if volume_24h is not None:
+                self.columns['volume_24h'][row] = volume_24h
+            if quote_volume_24h is not None:
+                self.columns['quote_volume_24h'][row] = quote_volume_24h
+
+    def on_trade(self, symbol: str, price: float, size: float, timestamp=None):
+        with self._lock:
+            row = self.add_contract(symbol)
+            self._roll(row, time.time() if timestamp is None else timestamp)
+            self.columns['last_price'][row] = price
+            self._has_trades[row] = True
+            self._current_volume[row] += size
+            self.columns['volume'][row] = self._sum_volume[row] + self._current_volume[row]
+
+    def on_derivatives(self, symbol: str, funding_rate=None, open_interest=None):
+        with self._lock:
+            row = self.add_contract(symbol)
+            if funding_rate is not None:
+                self.columns['funding_rate'][row] = funding_rate
+            if open_interest is not None:
+                self.columns['open_interest'][row] = open_interest
+
+    # ---------- queries ----------
+
+    def query(self, sort_by: str, n: int = 20, ascending: bool = False, **filters) -> list[str]:
+        '''
+        Returns the symbols of the n best contracts according to sort_by.
+        Filters are given as min_<column>=... / max_<column>=..., e.g.
+            screener.query('quote_volume_24h', 20, max_spread=0.0005)
+        Contracts without data for the sort column or one of the filter columns are skipped.
+        '''
+        if sort_by not in self.columns:
+            raise ValueError(f"Unknown screener column {sort_by}, use one of {COLUMNS}")
+
+        conditions = []
+        for name, limit in filters.items():
+            bound, _, column = name.partition('_')
+            if bound not in ('min', 'max') or column not in self.columns:
+                raise ValueError(f"Unknown screener filter {name}")
+            conditions.append((self.columns[column], bound == 'min', limit))
+
+        values = self.columns[sort_by]
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for row in range(len(self.symbols)):
+                # contracts that stopped ticking: move their window to now, so old volume/returns drop out
+                if self._roll(row, now):
+                    self._update_return(row)
+                if values[row] is None:
+                    continue
+                for column, is_min, limit in conditions:
+                    value = column[row]
+                    if value is None or (value < limit if is_min else value > limit):
+                        break
+                else:  # no break --> all conditions passed
+                    candidates.append(row)
+
+            if ascending:
+                best = heapq.nsmallest(n, candidates, key=values.__getitem__)
+            else:
+                best = heapq.nlargest(n, candidates, key=values.__getitem__)
+
+            return [self.symbols[row] for row in best]
+
+    def get_row(self, symbol: str) -> dict:
+        # all current statistics of one contract
+        with self._lock:
+            row = self._index.get(symbol)
+            if row is None:
+                return None
+            return {c: self.columns[c][row] for c in COLUMNS}
@@ -0,0 +1,169 @@
+#%%
+import logging
+import math
+import time
+import bisect
+from array import array
+
+from models import *
+
+logger = logging.getLogger()
+
+'''
+Compact per-symbol time series for the mark price / index price / funding rate / open interest feeds.
+
+array('q') / array('d') store plain 8 byte numbers instead of python float objects (~3x less memory than lists),
+and since data only arrives in time order, range queries are a binary search (bisect) on the timestamps.
+Missing values are stored as NaN.
+'''
+
+FIELDS = ['mark_price', 'index_price', 'funding_rate', 'open_interest']
+
+# default history kept per symbol by DerivativesStore (timestamp + 4 fields = 40 bytes per point):
+# - the last hour at full resolution (1s points): 3600 points, ~140 KB per symbol
+# - the last day at 1 minute: 1440 points, ~60 KB per symbol
+# --> ~60 MB for 300 symbols on binance !markPrice@arr@1s, instead of ~1 GB for a whole day of 1s points
+DEFAULT_MAX_LENGTH = 60 * 60
+DEFAULT_HISTORY_INTERVAL_MS = 60 * 1000
+DEFAULT_HISTORY_LENGTH = 24 * 60
+
+
+class TimeSeries:
+    def __init__(self, min_interval_ms: int = 0, max_length=None):
+        # updates closer than min_interval_ms to the previous point overwrite it instead of adding a new point
+        # (bitmex sends several instrument updates per second, we don't need all of them)
+        self.min_interval_ms = min_interval_ms
+        self.max_length = max_length  # None = keep everything
+
+        self.timestamps = array('q')  # ms
+        self.values: dict[str, array] = {f: array('d') for f in FIELDS}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp: int, values: dict[str, float]):
+        if len(self.timestamps) > 0:
+            last = self.timestamps[-1]
+            if timestamp < last:
+                return  # out of order update, would break the bisect in range()
+            if timestamp - last < self.min_interval_ms or timestamp == last:
+                # the timestamp of the point stays, otherwise frequent updates would push it forward forever
+                for f in FIELDS:
+                    self.values[f][-1] = _to_float(values.get(f))
+                return
+
+        self.timestamps.append(timestamp)
+        for f in FIELDS:
+            self.values[f].append(_to_float(values.get(f)))
+
+        if self.max_length is not None and len(self.timestamps) > self.max_length * 1.1:
+            # trim in chunks (10% at once) instead of on every append, deleting from the front of an array is O(n)
+            cut = len(self.timestamps) - self.max_length
+            del self.timestamps[:cut]
+            for f in FIELDS:
+                del self.values[f][:cut]
+
+    def _slice(self, start, end) -> tuple[int, int]:
+        i = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        j = len(self.timestamps) if end is None else bisect.bisect_right(self.timestamps, end)
+        return i, j
+
+    def range(self, field: str, start=None, end=None) -> tuple[array, array]:
+        # all points with start <= timestamp <= end (in ms), as (timestamps, values)
+        i, j = self._slice(start, end)
+        return self.timestamps[i:j], self.values[field][i:j]
+
+    def downsample(self, field: str, interval_ms: int, start=None, end=None, how: str = 'last') -> tuple[array, array]:
+        # one point per interval (timestamp = start of the interval), either the last value or the mean of the interval
+        i, j = self._slice(start, end)
+        timestamps = array('q')
+        values = array('d')
+
+        column = self.values[field]
+        bucket = None
+        total = 0.0
+        count = 0
+        for k in range(i, j):
+            value = column[k]
+            if math.isnan(value):
+                continue
+            b = self.timestamps[k] - self.timestamps[k] % interval_ms
+            if b != bucket:
+                if bucket is not None:
+                    timestamps.append(bucket)
+                    values.append(total / count if how == 'mean' else last)
+                bucket = b
+                total = 0.0
+                count = 0
+            last = value
+            total += value
+            count += 1
+
+        if bucket is not None:
+            timestamps.append(bucket)
+            values.append(total / count if how == 'mean' else last)
+
+        return timestamps, values
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+class DerivativesStore:
+    '''
+    Latest DerivativesData of every symbol plus its history as TimeSeries.
+    Fed by the websocket of the connectors, so e.g. the funding rates of all contracts are available without REST calls.
+
+    Two series per symbol: `series` holds the recent points at full resolution (min_interval_ms, last max_length points),
+    `history` holds a longer period with one point per history_interval_ms (the last value of each interval).
+    range() picks the right one.
+    '''
+    def __init__(self, min_interval_ms: int = 1000, max_length=DEFAULT_MAX_LENGTH,
+                 history_interval_ms: int = DEFAULT_HISTORY_INTERVAL_MS, history_length=DEFAULT_HISTORY_LENGTH):
+        # max_length/history_length=None keeps everything, only for short runs: the websocket feeds grow without bound
+        self.min_interval_ms = min_interval_ms
+        self.max_length = max_length
+        self.history_interval_ms = history_interval_ms
+        self.history_length = history_length
+
+        self.latest: dict[str, DerivativesData] = dict()
+        self.series: dict[str, TimeSeries] = dict()
+        self.history: dict[str, TimeSeries] = dict()
+
+    def update(self, data: DerivativesData):
+        if data.timestamp is None:
+            data.timestamp = int(time.time() * 1000)
+
+        latest = self.latest.get(data.symbol)
+        if latest is None:
+            latest = data
+            self.latest[data.symbol] = data
+        else:
+            # partial updates (bitmex): only overwrite the fields that were sent
+            for f in FIELDS + ['next_funding_time', 'timestamp']:
+                value = getattr(data, f)
+                if value is not None:
+                    setattr(latest, f, value)
+
+        series = self.series.get(data.symbol)
+        if series is None:
+            series = TimeSeries(self.min_interval_ms, self.max_length)
+            self.series[data.symbol] = series
+            self.history[data.symbol] = TimeSeries(self.history_interval_ms, self.history_length)
+        values = {f: getattr(latest, f) for f in FIELDS}
+        series.append(latest.timestamp, values)
+        self.history[data.symbol].append(latest.timestamp, values)  # updates within the interval overwrite the last point
+
+    def range(self, symbol: str, field: str, start=None, end=None) -> tuple[array, array]:
+        # full resolution if the recent series still reaches back to start, otherwise the coarse history
+        series = self.series.get(symbol)
+        if series is None:
+            return array('q'), array('d')
+        if start is None or len(series) == 0 or start < series.timestamps[0]:
+            series = self.history[symbol]
+        return series.range(field, start, end)
+
+    def funding_rates(self) -> dict[str, float]:
+        # current funding rate of every symbol, e.g. for funding carry across the whole universe
+        return {symbol: d.funding_rate for symbol, d in self.latest.items() if d.funding_rate is not None}